@@ -1,12 +1,39 @@
+import argparse
 import ast
+import hashlib
 import json
+import keyword
+import mmap
+import os
 import sys
-from collections import Counter
+import time
+import tokenize
+from collections import Counter, deque
+from dataclasses import dataclass
 import re
 
+# Files larger than this (in bytes) skip ast.parse and use the tokenizer fast path
+TOKEN_MODE_THRESHOLD = 1024 * 1024
+
+SMELL_CATEGORIES = ('LongMethod', 'GodClass', 'DuplicatedCode', 'LargeParameterList', 'MagicNumbers', 'FeatureEnvy')
+
+# Smells that can be detected from the token stream alone
+TOKEN_SMELLS = ('DuplicatedCode', 'LargeParameterList', 'MagicNumbers')
+
+@dataclass
+class BracketFrame:
+    """An open bracket seen by the tokenizer fast path."""
+    is_call: bool
+    func_name: str
+    start: tokenize.TokenInfo
+    commas: int = 0
+    has_arg: bool = False  # Anything since the last top-level comma
+    in_lambda: bool = False  # Commas belong to lambda parameters until ':'
+
 class CodeSmellDetector:
-    def __init__(self, enabled_smells):
+    def __init__(self, enabled_smells, token_mode_threshold=TOKEN_MODE_THRESHOLD):
         self.smells = enabled_smells
+        self.token_mode_threshold = token_mode_threshold
 
     def camel_to_snake(self, name):
         """Convert camelCase to snake_case"""
@@ -119,21 +146,24 @@ class CodeSmellDetector:
         """
         Detects both single-line and multi-line duplicated code blocks.
         Uses a sliding window (default: 2 lines) to find repeating patterns.
+        `code` is either the source text or an iterable of lines (token mode).
         """
         try:
-            # Split code into lines and strip whitespace
-            lines = [line.rstrip() for line in code.split('\n')]
+            # Split code into lines (or consume them lazily in token mode)
+            lines = code.split('\n') if isinstance(code, str) else code
             # Define how many consecutive lines make a "block" for comparison
             block_size = 1  # You can increase this (e.g., 3–5) for stricter detection
 
-            # Store blocks and where they appear
-            block_counts = {}
-            block_positions = {}
+            # Blocks are keyed by digest so unique lines cost a few bytes each.
+            # Singletons only remember their first line; positions and text are
+            # kept once a block repeats.
+            first_seen = {}
+            duplicates = {}
+            unique_blocks = 0
 
             # --- STEP 1: Normalize code lines ---
             # Ignore empty lines or trivial boilerplate
-            filtered_lines = []
-            original_indices = []  # Keep track of line numbers in the original file
+            window = deque(maxlen=block_size)  # (line number, stripped line)
 
             for i, line in enumerate(lines, 1):
                 stripped = line.strip()
@@ -145,38 +175,38 @@ class CodeSmellDetector:
                     stripped.startswith('@') or
                     'if __name__' in stripped):
                     continue
-                filtered_lines.append(stripped)
-                original_indices.append(i)
+                window.append((i, stripped))
+                if len(window) < block_size:
+                    continue
 
-            # --- STEP 2: Build blocks of consecutive lines ---
-            for i in range(len(filtered_lines) - block_size + 1):
-                block = "\n".join(filtered_lines[i:i + block_size])
+                # --- STEP 2: Build blocks of consecutive lines ---
+                block = "\n".join(text for _, text in window)
                 if len(block) < 10:
                     continue
 
-                if block not in block_counts:
-                    block_counts[block] = 0
-                    block_positions[block] = []
-
-                block_counts[block] += 1
-                block_positions[block].append(original_indices[i])
+                digest = int.from_bytes(hashlib.blake2b(block.encode('utf-8'), digest_size=8).digest(), 'big')
+                start = window[0][0]
+                if digest in duplicates:
+                    duplicates[digest][0].append(start)
+                elif digest in first_seen:
+                    duplicates[digest] = ([first_seen.pop(digest), start], block)
+                else:
+                    first_seen[digest] = start
+                    unique_blocks += 1
 
             # --- STEP 3: Report duplicated blocks ---
-            for block, count in block_counts.items():
-                if count > 1:
-                    positions = block_positions[block]
-                    report['DuplicatedCode'].append({
-                        'file': file_path,
-                        'lineStart': positions[0],
-                        'lineEnd': positions[-1] + block_size - 1,
-                        'message': f"Duplicate block appears {count} times at lines {positions}.",
-                        'snippet': block
-                    })
+            for positions, block in sorted(duplicates.values(), key=lambda entry: entry[0][0]):
+                report['DuplicatedCode'].append({
+                    'file': file_path,
+                    'lineStart': positions[0],
+                    'lineEnd': positions[-1] + block_size - 1,
+                    'message': f"Duplicate block appears {len(positions)} times at lines {positions}.",
+                    'snippet': block
+                })
 
             # --- Debug info ---
-            total_duplicates = sum(1 for c in block_counts.values() if c > 1)
             print(
-                f"DEBUG: Found {len(block_counts)} unique blocks, {total_duplicates} duplicated blocks",
+                f"DEBUG: Found {unique_blocks} unique blocks, {len(duplicates)} duplicated blocks",
                 file=sys.stderr
             )
 
@@ -243,20 +273,119 @@ class CodeSmellDetector:
         except Exception as e:
             print(f"Error in detect_feature_envy for {file_path}: {e}", file=sys.stderr)
 
+    def detect_token_smells(self, tokens, file_path, report, check_magic, check_calls):
+        """
+        Single pass over the token stream for files that are too big to parse
+        (or don't parse at all). Flags magic numbers and large call argument lists.
+        """
+        allowed = {0, 1, -1, 2}
+        frames = []  # One BracketFrame per open bracket
+        prev = prev2 = None
+        try:
+            for tok in tokens:
+                if tok.type in (tokenize.NL, tokenize.COMMENT, tokenize.ENCODING):
+                    continue
+
+                if check_magic and tok.type == tokenize.NUMBER:
+                    try:
+                        value = ast.literal_eval(tok.string)
+                    except (ValueError, SyntaxError):
+                        value = None
+                    if isinstance(value, (int, float, complex)) and value not in allowed and abs(value) not in allowed:
+                        report['MagicNumbers'].append({
+                            'file': file_path,
+                            'lineStart': tok.start[0],
+                            'lineEnd': tok.start[0],
+                            'message': f"Magic number {value} detected. Consider replacing with a named constant.",
+                            'snippet': str(value)
+                        })
+
+                if check_calls:
+                    if tok.type == tokenize.OP and tok.string in '([{':
+                        if frames:
+                            frames[-1].has_arg = True
+                        # name( or expr)( or expr]( is a call, unless it's a def/class header or a keyword.
+                        # match/case are soft keywords: only statements when they start a logical line
+                        starts_line = prev2 is None or prev2.type in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT)
+                        is_call = tok.string == '(' and prev is not None and (
+                            (prev.type == tokenize.NAME and not keyword.iskeyword(prev.string)
+                             and not (prev2 is not None and prev2.string in ('def', 'class'))
+                             and not (prev.string in ('match', 'case') and starts_line))
+                            or prev.string in (')', ']')
+                        )
+                        func_name = prev.string if is_call and prev.type == tokenize.NAME else "unknown"
+                        frames.append(BracketFrame(is_call, func_name, tok))
+                    elif tok.type == tokenize.OP and tok.string in ')]}':
+                        if frames:
+                            frame = frames.pop()
+                            total_args = frame.commas + (1 if frame.has_arg else 0)
+                            if frame.is_call and total_args > 6:  # Threshold for large call
+                                report['LargeParameterList'].append({
+                                    'file': file_path,
+                                    'lineStart': frame.start.start[0],
+                                    'lineEnd': frame.start.start[0],
+                                    'message': f"Function call '{frame.func_name}' has {total_args} arguments.",
+                                    'snippet': frame.start.line.strip()
+                                })
+                    elif frames:
+                        frame = frames[-1]
+                        if tok.type == tokenize.NAME and tok.string == 'lambda':
+                            frame.in_lambda = True
+                        elif tok.type == tokenize.OP and tok.string == ':' and frame.in_lambda:
+                            frame.in_lambda = False
+                        if tok.type == tokenize.OP and tok.string == ',' and not frame.in_lambda:
+                            frame.commas += 1
+                            frame.has_arg = False
+                        elif tok.type not in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+                            frame.has_arg = True
+
+                prev2, prev = prev, tok
+        except (tokenize.TokenError, SyntaxError) as e:
+            # Keep whatever was found before the tokenizer gave up
+            print(f"Tokenizer stopped early in {file_path}: {e}", file=sys.stderr)
+
+    def analyze_tokens(self, file_path, report):
+        """
+        Tokenizer-only fast path. The file is memory-mapped and streamed line by
+        line, so the source text is never held in memory as a whole. Duplicated
+        Code still keeps a small digest per unique line.
+        """
+        enabled = [smell for smell in self.smells
+                   if self.smells.get(smell, True) and smell in TOKEN_SMELLS]
+        print(f"Token mode smells for {file_path}: {enabled}", file=sys.stderr)
+        if not enabled or os.path.getsize(file_path) == 0:
+            return
+
+        with open(file_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if 'MagicNumbers' in enabled or 'LargeParameterList' in enabled:
+                    self.detect_token_smells(
+                        tokenize.tokenize(mm.readline), file_path, report,
+                        'MagicNumbers' in enabled, 'LargeParameterList' in enabled
+                    )
+                if 'DuplicatedCode' in enabled:
+                    mm.seek(0)
+                    lines = (line.decode('utf-8', 'replace') for line in iter(mm.readline, b''))
+                    self.detect_duplicated_code(lines, file_path, report)
+
     def analyze_file(self, file_path):
-        report = {
-            'LongMethod': [],
-            'GodClass': [],
-            'DuplicatedCode': [],
-            'LargeParameterList': [],
-            'MagicNumbers': [],
-            'FeatureEnvy': []
-        }
+        report = {smell: [] for smell in SMELL_CATEGORIES}
+        tree = None
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                code = f.read()
-                tree = ast.parse(code)
-                
+            if os.path.getsize(file_path) > self.token_mode_threshold:
+                print(f"{file_path} exceeds {self.token_mode_threshold} bytes, using tokenizer fast path", file=sys.stderr)
+                self.analyze_tokens(file_path, report)
+            else:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    code = f.read()
+                try:
+                    tree = ast.parse(code)
+                except SyntaxError as e:
+                    # A single syntax error shouldn't blank the whole file
+                    print(f"Syntax error in {file_path}: {e}; falling back to tokenizer", file=sys.stderr)
+                    self.analyze_tokens(file_path, report)
+
+            if tree is not None:
                 # Debug: Print enabled smells
                 print(f"Enabled smells for {file_path}: {self.smells}", file=sys.stderr)
                 
@@ -283,20 +412,197 @@ class CodeSmellDetector:
             
             return report
             
-        except SyntaxError as e:
-            print(f"Syntax error in {file_path}: {e}", file=sys.stderr)
-            return {k: {'count': 0, 'items': []} for k in report}
         except Exception as e:
             print(f"Error processing {file_path}: {e}", file=sys.stderr)
             return {k: {'count': 0, 'items': []} for k in report}
 
+def shard_key(path):
+    """
+    Path used to hash and time a file: relative to the working directory, so CI
+    runners with different workspace roots agree as long as they run from the repo root.
+    """
+    return os.path.relpath(path).replace(os.sep, '/')
+
+
+def shard_files(file_paths, shard_index, shard_count, timings=None):
+    """
+    Pick the files belonging to shard `shard_index` (1-based) out of `shard_count`.
+    Without timings each file goes to a shard by a stable hash of its path, so every
+    CI node computes the same split. With timings from a previous run, files are
+    balanced greedily by cost (previous seconds, or file size when a file is new).
+    """
+    key = shard_key
+
+    if timings is None:
+        return [path for path in file_paths
+                if int(hashlib.sha1(key(path).encode('utf-8')).hexdigest(), 16) % shard_count == shard_index - 1]
+
+    # Previous timings are in seconds; unknown files are costed relative to their size
+    timed = {key(path): seconds for path, seconds in timings.items()}
+    known_bytes = sum(os.path.getsize(p) for p in file_paths if key(p) in timed and os.path.exists(p))
+    known_seconds = sum(timed[key(p)] for p in file_paths if key(p) in timed and os.path.exists(p))
+    seconds_per_byte = known_seconds / known_bytes if known_bytes else 1.0
+
+    def cost(path):
+        if key(path) in timed:
+            return timed[key(path)]
+        return os.path.getsize(path) * seconds_per_byte if os.path.exists(path) else 0.0
+
+    loads = [0.0] * shard_count
+    selected = []
+    for path in sorted(file_paths, key=lambda p: (-cost(p), key(p))):
+        target = min(range(shard_count), key=lambda i: (loads[i], i))
+        loads[target] += cost(path)
+        if target == shard_index - 1:
+            selected.append(path)
+    return selected
+
+
+def merge_reports(reports):
+    """
+    Combine per-file or per-shard reports into one. Items are sorted by location so
+    the result doesn't depend on the order the shards finished in, and counts are
+    recomputed from the merged items. Per-file timings are carried over when present.
+    """
+    merged = {smell: [] for smell in SMELL_CATEGORIES}
+    timings = {}
+    files = set()
+    for report in reports:
+        for category, findings in report.items():
+            if category == 'timings':
+                timings.update(findings)
+            elif category == 'files':
+                files.update(findings)
+            elif category not in ('shard', 'inputs'):
+                merged.setdefault(category, []).extend(findings.get('items', []))
+
+    for category in merged:
+        items = sorted(merged[category], key=lambda item: (item['file'], item['lineStart'], item['lineEnd']))
+        merged[category] = {'count': len(items), 'items': items}
+    if timings:
+        merged['timings'] = dict(sorted(timings.items()))
+    if files:
+        merged['files'] = sorted(files)
+    return merged
+
+
+def input_set(file_paths):
+    """Count and digest of the full file list a sharded run was given, before sharding."""
+    keys = sorted(shard_key(path) for path in file_paths)
+    return {'count': len(keys), 'digest': hashlib.sha1('\n'.join(keys).encode('utf-8')).hexdigest()}
+
+
+def check_shard_reports(reports):
+    """
+    Make sure the reports are exactly shards 1..N of one sharded run over the same
+    input files, so merging them neither drops files nor counts anything twice.
+    """
+    shards = []
+    for report in reports:
+        if 'shard' not in report or 'inputs' not in report:
+            raise ValueError("report was not produced by a --shard run")
+        shards.append(tuple(report['shard']))
+
+    counts = {count for _, count in shards}
+    if len(counts) != 1:
+        raise ValueError(f"reports come from different shard counts: {sorted(counts)}")
+    count = counts.pop()
+    indices = Counter(index for index, _ in shards)
+    out_of_range = sorted(index for index in indices if not 1 <= index <= count)
+    repeated = sorted(index for index, seen in indices.items() if seen > 1)
+    missing = sorted(set(range(1, count + 1)) - set(indices))
+    if out_of_range:
+        raise ValueError(f"shard(s) {out_of_range} out of range for {count} shards")
+    if repeated:
+        raise ValueError(f"shard(s) {repeated} of {count} passed more than once")
+    if missing:
+        raise ValueError(f"shard(s) {missing} of {count} missing")
+
+    inputs = reports[0]['inputs']
+    if any(report['inputs'] != inputs for report in reports):
+        raise ValueError("shards were run over different input files (or from different directories)")
+    owners = {}
+    for (index, _), report in zip(shards, reports):
+        for path in set(report['files']):
+            if owners.setdefault(path, index) != index:
+                raise ValueError(f"'{path}' was analyzed by shards {owners[path]} and {index}")
+    covered = sorted(path for report in reports for path in report['files'])
+    if len(covered) != inputs['count'] or input_set(covered) != inputs:
+        raise ValueError("shard files don't add up to the input files")
+
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got '{value}'")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 1 and N, got '{value}'")
+    return index, count
+
+
 if __name__ == "__main__":
-    file_paths = sys.argv[1:-1]  # All but the last argument
-    enabled_smells = json.loads(sys.argv[-1])  # Last argument is the JSON string of enabled smells
+    parser = argparse.ArgumentParser(description="Detect code smells in Python files.")
+    parser.add_argument('args', nargs='+',
+                        help="files to analyze followed by the JSON string of enabled smells "
+                             "(or shard reports to combine with --merge)")
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help="only analyze the i-th of N deterministic shards of the files "
+                             "(run every shard from the repo root)")
+    parser.add_argument('--timings', metavar='REPORT',
+                        help="previous report whose per-file timings are used to balance shards")
+    parser.add_argument('--merge', action='store_true',
+                        help="merge the given shard reports into one report")
+    options = parser.parse_args()
+    if options.timings and not options.shard:
+        parser.error("--timings only applies together with --shard")
+
+    def load_report(report_path):
+        try:
+            with open(report_path, 'r', encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read report {report_path}: {e}")
+        if not isinstance(report, dict):
+            parser.error(f"cannot read report {report_path}: expected a JSON object")
+        return report
+
+    if options.merge:
+        shard_reports = [load_report(report_path) for report_path in options.args]
+        try:
+            check_shard_reports(shard_reports)
+        except ValueError as e:
+            parser.error(f"cannot merge: {e}")
+        print(json.dumps(merge_reports(shard_reports)))
+        sys.exit(0)
+
+    if len(options.args) < 2:
+        parser.error("expected at least one file followed by the JSON string of enabled smells")
+    file_paths = options.args[:-1]  # All but the last argument
+    enabled_smells = json.loads(options.args[-1])  # Last argument is the JSON string of enabled smells
+
+    if options.shard:
+        timings = None
+        if options.timings:
+            timings = load_report(options.timings).get('timings', {})
+        all_file_paths = file_paths
+        file_paths = shard_files(file_paths, *options.shard, timings=timings)
+        print(f"Shard {options.shard[0]}/{options.shard[1]}: {len(file_paths)} files", file=sys.stderr)
+
     detector = CodeSmellDetector(enabled_smells)
-    all_findings = {}
+    file_reports = []
     for file_path in file_paths:
+        started = time.perf_counter()
         findings = detector.analyze_file(file_path)
-        all_findings.update(findings)
+        if options.shard:
+            # Recorded so the next run can balance shards with --timings
+            findings['timings'] = {shard_key(file_path): round(time.perf_counter() - started, 4)}
+        file_reports.append(findings)
 
-    print(json.dumps(all_findings))
\ No newline at end of file
+    report = merge_reports(file_reports)
+    if options.shard:
+        # Lets --merge spot missing or repeated shards
+        report['shard'] = list(options.shard)
+        report['inputs'] = input_set(all_file_paths)
+        report['files'] = sorted(shard_key(file_path) for file_path in file_paths)
+    print(json.dumps(report))
@@ -0,0 +1,240 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from code_smell_detector import CodeSmellDetector, check_shard_reports, input_set, merge_reports, shard_files
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BACKEND_DIR)
+ALL_SMELLS_ENABLED = {
+    "LongMethod": True, "GodClass": True, "DuplicatedCode": True,
+    "LargeParameterList": True, "MagicNumbers": True, "FeatureEnvy": True,
+}
+TOKEN_SMELLS_ENABLED = {"DuplicatedCode": True, "LargeParameterList": True, "MagicNumbers": True}
+
+
+class TestTokenFastPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, code):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(textwrap.dedent(code))
+        return path
+
+    def analyze(self, path, token_mode_threshold):
+        detector = CodeSmellDetector(TOKEN_SMELLS_ENABLED, token_mode_threshold=token_mode_threshold)
+        with contextlib.redirect_stderr(io.StringIO()):
+            return detector.analyze_file(path)
+
+    def summarize(self, report):
+        # The AST path also flags definitions; token mode only counts calls
+        calls = [item for item in report["LargeParameterList"]["items"] if "call" in item["message"]]
+        return {
+            "calls": sorted((item["lineStart"], item["message"]) for item in calls),
+            "magic": sorted((item["lineStart"], item["message"]) for item in report["MagicNumbers"]["items"]),
+            "duplicates": [(item["lineStart"], item["message"]) for item in report["DuplicatedCode"]["items"]],
+        }
+
+    def assert_token_mode_matches_ast(self, code):
+        path = self.write("snippet.py", code)
+        ast_report = self.summarize(self.analyze(path, token_mode_threshold=10 ** 9))
+        token_report = self.summarize(self.analyze(path, token_mode_threshold=0))
+        self.assertEqual(token_report, ast_report)
+        return token_report
+
+    def test_trailing_comma_in_call(self):
+        report = self.assert_token_mode_matches_ast("""
+            total = combine(10, 20, 30, 40, 50, 60, 70,)
+            small = combine(10, 20, 30, 40, 50, 60,)
+        """)
+        self.assertEqual(report["calls"], [(2, "Function call 'combine' has 7 arguments.")])
+
+    def test_lambda_parameters_are_not_arguments(self):
+        report = self.assert_token_mode_matches_ast("""
+            result = apply(lambda a, b, c, d, e, f, g: a, items)
+            other = apply(lambda a, b: a, 1, 2, 3, 4, 5, 6)
+        """)
+        self.assertEqual(report["calls"], [(3, "Function call 'apply' has 7 arguments.")])
+
+    def test_class_bases_and_def_headers_are_not_calls(self):
+        report = self.assert_token_mode_matches_ast("""
+            class Mixed(A, B, C, D, E, F, G):
+                pass
+
+            def wide(a, b, c, d, e, f, g):
+                return a
+        """)
+        self.assertEqual(report["calls"], [])
+
+    def test_keyword_before_parenthesis_is_not_a_call(self):
+        report = self.assert_token_mode_matches_ast("""
+            if value in (11, 12, 13, 14, 15, 16, 17):
+                print(value)
+            result = not (alpha, beta, gamma, delta, epsilon, zeta, eta)
+        """)
+        self.assertEqual(report["calls"], [])
+
+    def test_match_and_case_statements_are_not_calls(self):
+        report = self.assert_token_mode_matches_ast("""
+            match (alpha, beta, gamma, delta, epsilon, zeta, eta):
+                case (a, b, c, d, e, f, g):
+                    found = re.match(pattern, text, 0, 0, 0, 0, 0)
+        """)
+        self.assertEqual(report["calls"], [(4, "Function call 'match' has 7 arguments.")])
+
+    def test_chained_call_reports_unknown_name(self):
+        report = self.assert_token_mode_matches_ast("""
+            value = factory(*args, **kwargs)(1, 2, 3, 4, 5, 6, 7)
+            nested = outer(inner(1, 2, 3, 4, 5, 6, 7), [8, 9])
+        """)
+        self.assertEqual(report["calls"], [
+            (2, "Function call 'unknown' has 7 arguments."),
+            (3, "Function call 'inner' has 7 arguments."),
+        ])
+
+    def test_magic_numbers_and_duplicates_match(self):
+        report = self.assert_token_mode_matches_ast("""
+            rate = 0.75 * -42 + 1_000 + 0x1F + 3j
+            retries = compute_retries(rate)
+            retries = compute_retries(rate)
+        """)
+        self.assertEqual(len(report["magic"]), 5)
+        self.assertEqual(report["duplicates"], [(3, "Duplicate block appears 2 times at lines [3, 4].")])
+
+    def test_syntax_error_still_reports_findings(self):
+        path = self.write("broken.py", """
+            threshold = 4242
+            send(1, 2, 3, 4, 5, 6, 7)
+            def broken(:
+                pass
+        """)
+        report = self.analyze(path, token_mode_threshold=10 ** 9)
+        self.assertEqual(report["MagicNumbers"]["count"], 6)
+        self.assertEqual(report["LargeParameterList"]["count"], 1)
+
+
+class TestSharding(unittest.TestCase):
+    files = ["smelly_program.py", "smelly_program_test.py", "backend/external_sample.py",
+             "backend/code_smell_detector.py", "backend/code_smell_detector_test.py"]
+
+    def setUp(self):
+        self.previous_cwd = os.getcwd()
+        os.chdir(REPO_ROOT)
+
+    def tearDown(self):
+        os.chdir(self.previous_cwd)
+
+    def run_detector(self, *args, cwd=REPO_ROOT):
+        result = subprocess.run(
+            [sys.executable, os.path.join(BACKEND_DIR, "code_smell_detector.py"), *args],
+            cwd=cwd, capture_output=True, text=True, check=True,
+        )
+        return json.loads(result.stdout)
+
+    def assert_partition(self, shards):
+        selected = [path for shard in shards for path in shard]
+        self.assertEqual(sorted(selected), sorted(self.files))
+
+    def test_hash_shards_are_disjoint_and_cover_every_file(self):
+        for count in (1, 2, 3, 7):
+            self.assert_partition([shard_files(self.files, index, count) for index in range(1, count + 1)])
+
+    def test_hash_shards_ignore_absolute_paths(self):
+        absolute = [os.path.join(REPO_ROOT, path) for path in self.files]
+        for index in (1, 2, 3):
+            self.assertEqual(
+                [os.path.relpath(path) for path in shard_files(absolute, index, 3)],
+                [os.path.normpath(path) for path in shard_files(self.files, index, 3)],
+            )
+
+    def test_timed_shards_are_disjoint_and_balanced(self):
+        # One new file without timings is costed from its size
+        timings = {path: seconds for path, seconds in zip(self.files[:-1], (4.0, 1.0, 1.0, 2.0))}
+        shards = [shard_files(self.files, index, 2, timings=timings) for index in (1, 2)]
+        self.assert_partition(shards)
+        # The two most expensive files go to different shards
+        self.assertIn("smelly_program.py", shards[0])
+        self.assertIn("backend/code_smell_detector.py", shards[1])
+
+    def test_merged_shards_match_unsharded_run(self):
+        smells = json.dumps(ALL_SMELLS_ENABLED)
+        full = self.run_detector(*self.files, smells)
+        shard_reports = [self.run_detector("--shard", f"{index}/3", *self.files, smells) for index in (1, 2, 3)]
+        for index, report in enumerate(shard_reports, 1):
+            self.assertEqual(report["shard"], [index, 3])
+
+        check_shard_reports(shard_reports)
+        merged = merge_reports(reversed(shard_reports))
+        self.assertEqual(sorted(merged.pop("timings")), sorted(self.files))
+        self.assertEqual(merged.pop("files"), sorted(self.files))
+        self.assertEqual(merged, full)
+
+    def shard_report(self, index, count, files, inputs=("a.py", "b.py", "c.py")):
+        return {"shard": [index, count], "files": list(files), "inputs": input_set(inputs)}
+
+    def test_check_rejects_repeated_missing_or_mixed_shards(self):
+        check_shard_reports([self.shard_report(2, 2, ["c.py"]), self.shard_report(1, 2, ["a.py", "b.py"])])
+        with self.assertRaisesRegex(ValueError, "more than once"):
+            check_shard_reports([self.shard_report(1, 2, ["a.py"]), self.shard_report(1, 2, ["a.py"]),
+                                 self.shard_report(2, 2, ["b.py", "c.py"])])
+        with self.assertRaisesRegex(ValueError, "missing"):
+            check_shard_reports([self.shard_report(1, 3, ["a.py"]), self.shard_report(3, 3, ["b.py", "c.py"])])
+        with self.assertRaisesRegex(ValueError, "different shard counts"):
+            check_shard_reports([self.shard_report(1, 2, ["a.py"]), self.shard_report(2, 3, ["b.py", "c.py"])])
+        with self.assertRaisesRegex(ValueError, "--shard"):
+            check_shard_reports([{"MagicNumbers": {"count": 0, "items": []}}])
+
+    def test_check_rejects_out_of_range_shard(self):
+        with self.assertRaisesRegex(ValueError, "out of range"):
+            check_shard_reports([self.shard_report(1, 2, ["a.py"]), self.shard_report(2, 2, ["b.py", "c.py"]),
+                                 self.shard_report(3, 2, ["a.py"])])
+
+    def test_check_rejects_overlapping_or_incomplete_files(self):
+        with self.assertRaisesRegex(ValueError, "analyzed by shards 1 and 2"):
+            check_shard_reports([self.shard_report(1, 2, ["a.py", "b.py"]), self.shard_report(2, 2, ["b.py", "c.py"])])
+        with self.assertRaisesRegex(ValueError, "don't add up"):
+            check_shard_reports([self.shard_report(1, 2, ["a.py"]), self.shard_report(2, 2, ["c.py"])])
+        with self.assertRaisesRegex(ValueError, "different input files"):
+            check_shard_reports([self.shard_report(1, 2, ["a.py"]),
+                                 self.shard_report(2, 2, ["b.py"], inputs=("a.py", "b.py"))])
+
+    def test_check_rejects_shards_run_from_different_directories(self):
+        smells = json.dumps(TOKEN_SMELLS_ENABLED)
+        from_root = self.run_detector("--shard", "1/2", *self.files, smells)
+        from_backend = self.run_detector(
+            "--shard", "2/2", *(os.path.relpath(os.path.join(REPO_ROOT, path), BACKEND_DIR) for path in self.files),
+            smells, cwd=BACKEND_DIR,
+        )
+        with self.assertRaisesRegex(ValueError, "different input files"):
+            check_shard_reports([from_root, from_backend])
+
+    def test_cli_reports_bad_arguments_without_traceback(self):
+        smells = json.dumps(TOKEN_SMELLS_ENABLED)
+        missing = os.path.join(BACKEND_DIR, "no-such-report.json")
+        cases = [
+            (["--merge", missing], "cannot read report"),
+            (["--merge", os.path.join(REPO_ROOT, "README.md")], "cannot read report"),
+            (["--timings", missing, "smelly_program.py", smells], "--timings only applies together with --shard"),
+        ]
+        for args, message in cases:
+            result = subprocess.run(
+                [sys.executable, os.path.join(BACKEND_DIR, "code_smell_detector.py"), *args],
+                cwd=REPO_ROOT, capture_output=True, text=True,
+            )
+            self.assertEqual(result.returncode, 2)
+            self.assertIn(message, result.stderr)
+            self.assertNotIn("Traceback", result.stderr)
+
+if __name__ == "__main__":
+    unittest.main()